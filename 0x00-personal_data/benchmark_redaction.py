@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Module benchmark_redaction
+Measures the throughput and latency of filter_datum and RedactingFormatter
+"""
+import argparse
+import itertools
+import json
+import logging
+import platform
+import sys
+import time
+from typing import Callable, Dict, List
+from filtered_logger import RedactingFormatter, filter_datum
+
+FIELD_COUNTS = (1, 3, 5, 10)
+MESSAGE_LENGTHS = (64, 512, 4096)
+POSITIONS = ('start', 'end')
+HIT_RATIOS = (0.0, 0.5, 1.0)
+PERCENTILES = (50, 90, 99)
+
+
+def build_message(fields: List[str], length: int, position: str,
+                  hit_ratio: float) -> str:
+    """
+    Builds a `field=value;` log line of about length characters
+    Args:
+      fields(list): the redacted fields
+      length(int): the target length of the line
+      position(str): 'start' or 'end', where the PII fields are placed
+      hit_ratio(float): the share of the redacted fields present in the line
+    """
+    hits = fields[:round(len(fields) * hit_ratio)]
+    pii = ''.join('{}=value{};'.format(field, i)
+                  for i, field in enumerate(hits))
+    padding = []
+    size = len(pii)
+    for i in itertools.count():
+        if size >= length:
+            break
+        pair = 'pad{}=xxxxxxxxxxxxxxxx;'.format(i)
+        padding.append(pair)
+        size += len(pair)
+    padding = ''.join(padding)
+    return pii + padding if position == 'start' else padding + pii
+
+
+def percentile(samples: List[float], rank: int) -> float:
+    """ Returns the rank-th percentile of sorted samples """
+    index = min(len(samples) - 1, int(len(samples) * rank / 100))
+    return samples[index]
+
+
+def measure(redact: Callable[[], str], lines: int) -> Dict:
+    """
+    Calls redact lines times
+    Returns:
+      the lines per second and the per-line latency percentiles in
+      microseconds
+    """
+    clock = time.perf_counter
+    latencies = []
+    for _ in range(lines):
+        start = clock()
+        redact()
+        latencies.append(clock() - start)
+    total = sum(latencies)
+    latencies.sort()
+    result = {'lines_per_second': lines / total if total else 0.0}
+    for rank in PERCENTILES:
+        result['p{}_us'.format(rank)] = percentile(latencies, rank) * 1e6
+    return result
+
+
+def run(lines: int) -> List[Dict]:
+    """ Runs every benchmark case and returns their results """
+    results = []
+    cases = itertools.product(FIELD_COUNTS, MESSAGE_LENGTHS, POSITIONS,
+                              HIT_RATIOS)
+    for count, length, position, hit_ratio in cases:
+        fields = ['field{}'.format(i) for i in range(count)]
+        message = build_message(fields, length, position, hit_ratio)
+        formatter = RedactingFormatter(fields)
+        record = logging.LogRecord("user_data", logging.INFO, __file__, 0,
+                                   message, None, None)
+        targets = {
+            'filter_datum':
+                lambda: filter_datum(fields, '***', message, ';'),
+            'RedactingFormatter': lambda: formatter.format(record),
+        }
+        for target, redact in targets.items():
+            case = {
+                'target': target,
+                'fields': count,
+                'length': len(message),
+                'position': position,
+                'hit_ratio': hit_ratio,
+            }
+            case.update(measure(redact, lines))
+            results.append(case)
+    return results
+
+
+def case_key(case: Dict) -> tuple:
+    """ Returns the identity of a benchmark case """
+    return (case['target'], case['fields'], case['length'],
+            case['position'], case['hit_ratio'])
+
+
+def compare(results: List[Dict], baseline: List[Dict],
+            tolerance: float) -> int:
+    """
+    Prints the throughput of each case relative to the baseline
+    Returns:
+      the number of cases slower than the baseline by more than tolerance
+    """
+    reference = {case_key(case): case for case in baseline}
+    regressions = 0
+    for case in results:
+        base = reference.get(case_key(case))
+        if base is None or not base['lines_per_second']:
+            continue
+        ratio = case['lines_per_second'] / base['lines_per_second']
+        flag = ''
+        if ratio < 1 - tolerance:
+            regressions += 1
+            flag = '  REGRESSION'
+        print("{:<18} fields={:<3} length={:<5} {:<5} hits={:<4} "
+              "x{:.2f}{}".format(case['target'], case['fields'],
+                                 case['length'], case['position'],
+                                 case['hit_ratio'], ratio, flag))
+    return regressions
+
+
+def main() -> None:
+    """ Parses the command line, runs the benchmark and saves the results """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--lines', type=int, default=2000,
+                        help="lines redacted per case")
+    parser.add_argument('-o', '--output', default=None,
+                        help="save the results as JSON to this file")
+    parser.add_argument('-b', '--baseline', default=None,
+                        help="JSON results of a previous run to compare to")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help="allowed throughput loss against the baseline")
+    args = parser.parse_args()
+
+    results = run(args.lines)
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'lines': args.lines,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    else:
+        for case in results:
+            print("{:<18} fields={:<3} length={:<5} {:<5} hits={:<4} "
+                  "{:>10.0f} lines/s  p50={:.1f}us p99={:.1f}us".format(
+                      case['target'], case['fields'], case['length'],
+                      case['position'], case['hit_ratio'],
+                      case['lines_per_second'], case['p50_us'],
+                      case['p99_us']))
+
+
+if __name__ == "__main__":
+    main()
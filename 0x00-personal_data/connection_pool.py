@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Module connection_pool
+Implements a pool of reusable database connections
+"""
+import queue
+import threading
+from typing import Any, Callable
+
+
+class PoolTimeout(Exception):
+    """ Raised when no connection can be checked out in time
+    """
+
+
+class PooledConnection:
+    """ Proxy to a pooled connection
+    Attribute access is forwarded to the underlying connection and
+    close() hands the connection back to its pool instead of closing it
+    """
+
+    def __init__(self, pool: 'ConnectionPool', connection: Any):
+        """ Initializing the proxy with its pool and connection
+        """
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name: str) -> Any:
+        """ Forwards attribute access to the checked out connection
+        """
+        if self._connection is None:
+            raise AttributeError("Connection already returned to the pool")
+        return getattr(self._connection, name)
+
+    def close(self) -> None:
+        """ Returns the connection to the pool
+        """
+        if self._connection is not None:
+            self._pool.release(self._connection)
+            self._connection = None
+
+    def __enter__(self) -> 'PooledConnection':
+        """ Context manager entry
+        """
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """ Context manager exit, returns the connection to the pool
+        """
+        self.close()
+
+
+class ConnectionPool:
+    """ Pool of at most size connections created by connect
+    Methods:
+      - get()
+      - release()
+      - close()
+    """
+
+    def __init__(self, connect: Callable[[], Any], size: int = 5,
+                 timeout: float = 30.0,
+                 ping: Callable[[Any], Any] = None):
+        """ Initializing the pool
+        Args:
+          connect: function opening a new connection
+          size(int): the maximum number of connections
+          timeout(float): seconds to wait for a free connection
+          ping: function raising when a connection is no longer usable,
+            calls connection.ping() by default
+        """
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._connect = connect
+        self._ping = ping if ping is not None else self._default_ping
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @staticmethod
+    def _default_ping(connection: Any) -> None:
+        """ Checks the connection is still alive with a round trip
+        """
+        connection.ping()
+
+    def _is_alive(self, connection: Any) -> bool:
+        """ Returns True if the connection answers the liveness ping
+        """
+        try:
+            self._ping(connection)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(connection: Any) -> None:
+        """ Closes a connection, ignoring errors from a dead socket
+        """
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def get(self, timeout: float = None) -> PooledConnection:
+        """
+        Checks out a connection, waiting at most timeout seconds
+        Idle connections failing the liveness ping are replaced by new ones
+        Raises:
+          PoolTimeout: when every connection stays checked out
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolTimeout(
+                "No connection available after {}s".format(timeout))
+        try:
+            connection = None
+            while connection is None:
+                try:
+                    connection = self._idle.get_nowait()
+                except queue.Empty:
+                    connection = self._connect()
+                    break
+                if not self._is_alive(connection):
+                    self._discard(connection)
+                    connection = None
+        except BaseException:
+            self._slots.release()
+            raise
+        return PooledConnection(self, connection)
+
+    def release(self, connection: Any) -> None:
+        """ Puts a checked out connection back in the pool
+        Its transaction is rolled back first, so the next user does not
+        read from a stale snapshot; a connection failing that is closed
+        """
+        try:
+            connection.rollback()
+        except Exception:
+            self._discard(connection)
+        else:
+            self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """ Closes every idle connection
+        """
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
@@ -1,14 +1,45 @@
 #!/usr/bin/env python3
 """ Module encrypt_password """
 
+import time
+from typing import Optional
 import bcrypt
 
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
 
-def hash_password(password: str) -> bytes:
+
+def calibrate_rounds(target_ms: float, min_rounds: int = MIN_ROUNDS,
+                     max_rounds: int = MAX_ROUNDS) -> int:
+    """
+    Picks the bcrypt cost to use on this machine.
+    Args:
+      target_ms (float): The acceptable hashing latency in milliseconds.
+      min_rounds (int): The lowest cost ever returned.
+      max_rounds (int): The highest cost ever returned.
+
+    Returns:
+      int: The highest cost whose hash takes at most target_ms.
+    """
+    rounds = min_rounds
+    while rounds < max_rounds:
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # every extra round doubles the work
+        if elapsed_ms * 2 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+def hash_password(password: str, rounds: Optional[int] = None) -> bytes:
     """
     Hashes and salts the provided password using bcrypt.
     Args:
       password (str): The plain text password to be hashed.
+      rounds (int): The bcrypt cost, DEFAULT_ROUNDS when None.
 
     Returns:
       bytes: The salted and hashed password as a byte string.
@@ -18,7 +49,7 @@ def hash_password(password: str) -> bytes:
     bytes = password.encode('utf-8')
 
     # generating the salt
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds or DEFAULT_ROUNDS)
 
     # Hashing the password
     hashed_password = bcrypt.hashpw(bytes, salt)
@@ -48,3 +79,17 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     result = bcrypt.checkpw(userBytes, hashed_password)
 
     return result
+
+
+def needs_rehash(hashed_password: bytes, rounds: int) -> bool:
+    """
+    Checks if a hashed password was made at another cost.
+    Args:
+      hashed_password (bytes): The hashed password stored in the database.
+      rounds (int): The current bcrypt cost.
+
+    Returns:
+      bool: True if the password should be hashed again at rounds.
+    """
+    # a bcrypt hash reads $2b$<cost>$<salt and hash>
+    return int(hashed_password.split(b'$')[2]) != rounds
@@ -4,12 +4,29 @@ Module filtered_logger
 Implements a simple logger
 """
 import re
-from typing import List
+from functools import lru_cache, partial
+from typing import (Callable, Dict, Iterable, Iterator, List, Mapping,
+                    Optional, Sequence, Set, Tuple)
+from datetime import datetime
+import atexit
+import hashlib
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 import mysql.connector
+from connection_pool import ConnectionPool, PooledConnection
 
 PII_FIELDS = ('name', 'email', 'phone', 'ssn', 'password')
+BATCH_SIZE = 1000
+QUEUE_SIZE = 10000
+COLUMN_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
 
 
 class RedactingFormatter(logging.Formatter):
@@ -25,12 +42,106 @@ class RedactingFormatter(logging.Formatter):
         """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self._redact = redactor(fields, self.REDACTION, self.SEPARATOR)
 
     def format(self, record: logging.LogRecord) -> str:
         """ Adds redaction to the specified fields
+        Records logged with extra={'redacted': True} were masked by the
+        caller (see redact_rows) and are not scanned again
+        """
+        if getattr(record, 'redacted', False):
+            return super().format(record)
+        return self._redact(super().format(record))
+
+
+class StructuredRedactingFormatter(RedactingFormatter):
+    """ Redacting Formatter class for structured records
+    Records logged with a mapping as argument, e.g.
+    logger.info("login", {"email": email, "ip": ip}), have their PII keys
+    masked before formatting, so no regex runs on the rendered message.
+    Other records fall back to the RedactingFormatter behaviour; in json
+    output they become a document with the redacted message and no fields.
+    """
+
+    OUTPUTS = ('text', 'json')
+
+    def __init__(self, fields: List[str], output: str = 'text'):
+        """ Initializaing the Structured Redacting Formatter class
+        Args:
+          fields(list): the keys to mask
+          output(str): 'text' for `key=value;` pairs or 'json' for JSON lines
         """
-        return filter_datum(self.fields, self.REDACTION,
-                            super().format(record), self.SEPARATOR)
+        if output not in self.OUTPUTS:
+            raise ValueError("Unknown output: {}".format(output))
+        super(StructuredRedactingFormatter, self).__init__(fields)
+        self.output = output
+        self._masked = frozenset(fields)
+
+    def mask(self, data: Mapping) -> Dict:
+        """ Returns a copy of data with the PII keys redacted
+        """
+        return {key: self.REDACTION if key in self._masked else value
+                for key, value in data.items()}
+
+    def format(self, record: logging.LogRecord) -> str:
+        """ Masks the record fields then renders them as text or JSON
+        """
+        structured = isinstance(record.args, Mapping)
+        if not structured and self.output == 'text':
+            return super().format(record)
+        if self.output == 'json':
+            if structured:
+                message, data = str(record.msg), self.mask(record.args)
+            elif getattr(record, 'redacted', False):
+                message, data = record.getMessage(), {}
+            else:
+                message, data = self._redact(record.getMessage()), {}
+            document = {
+                'name': record.name,
+                'levelname': record.levelname,
+                'asctime': self.formatTime(record),
+                'message': message,
+                'fields': data,
+            }
+            return json.dumps(document, default=str)
+        data = self.mask(record.args)
+        pairs = ' '.join('{}={}{}'.format(key, value, self.SEPARATOR)
+                         for key, value in data.items())
+        message = '{} {}'.format(record.msg, pairs) if record.msg else pairs
+        structured = logging.makeLogRecord(record.__dict__)
+        structured.msg, structured.args = message, None
+        return logging.Formatter.format(self, structured)
+
+
+@lru_cache(maxsize=128)
+def _compile_redactor(fields: Tuple[str, ...], redaction: str,
+                      separator: str) -> Callable[[str], str]:
+    """
+    Builds the single pass redaction function for a set of fields
+    All fields are folded into one alternation pattern so that a message
+    is scanned once, whatever the number of fields
+    """
+    if not fields:
+        return str
+    pattern = re.compile(r"(?P<field>{})=.*?{}".format(
+        '|'.join(re.escape(field) for field in fields),
+        re.escape(separator)))
+    replacement = r"\g<field>={}{}".format(
+        redaction.replace('\\', r'\\'), separator.replace('\\', r'\\'))
+    return partial(pattern.sub, replacement)
+
+
+def redactor(fields: List[str], redaction: str,
+             separator: str) -> Callable[[str], str]:
+    """
+    Returns a function obfuscating the given fields of a log message
+    The compiled pattern is cached per (fields, redaction, separator)
+    Args:
+      fields(list): representing all fields to obfuscate
+      redaction(str): representing by what the field will be obfuscated
+      separator(str): representing character separating fields in message
+    """
+    return _compile_redactor(tuple(fields), redaction, separator)
 
 
 def filter_datum(fields: List[str], redaction: str,
@@ -43,15 +154,97 @@ def filter_datum(fields: List[str], redaction: str,
       message(str): representing the log line
       separator(str): representing character separating fields in message
     """
-    for field in fields:
-        message = re.sub(r"{}=(.*?){}".format(field, separator),
-                         f'{field}={redaction}{separator}', message)
-    return message
+    return redactor(fields, redaction, separator)(message)
 
 
-def get_logger() -> logging.Logger:
+def filter_data(fields: List[str], redaction: str,
+                messages: Iterable[str], separator: str) -> List[str]:
     """
-    function that takes no arguments and returns a logging.Logger object
+    Returns every log message of messages obfuscated
+    Same as filter_datum, with the pattern looked up once for the batch
+    """
+    return list(map(redactor(fields, redaction, separator), messages))
+
+
+def redact_rows(columns: Sequence[str], rows: Iterable[Sequence],
+                fields: List[str], redaction: str) -> List[List]:
+    """
+    Returns the rows with the values of the given fields obfuscated
+    Values are masked by column index, no regex is involved
+    Args:
+      columns(list): the column names of the rows
+      rows(list): the rows, as sequences of column values
+      fields(list): representing all fields to obfuscate
+      redaction(str): representing by what the field will be obfuscated
+    """
+    masked = [i for i, column in enumerate(columns) if column in fields]
+    result = []
+    for row in rows:
+        row = list(row)
+        for i in masked:
+            row[i] = redaction
+        result.append(row)
+    return result
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler enqueuing records on a bounded queue
+    When the queue is full, records are either waited for ('block')
+    or discarded and counted ('drop')
+    """
+
+    POLICIES = ('block', 'drop')
+
+    def __init__(self, log_queue: queue.Queue, policy: str = 'block'):
+        """ Initializing the handler with its queue and full-queue policy
+        """
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown queue policy: {}".format(policy))
+        super(BoundedQueueHandler, self).__init__(log_queue)
+        self.policy = policy
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """ Keeps mapping arguments intact for structured formatting
+        """
+        if isinstance(record.args, Mapping):
+            return logging.makeLogRecord(record.__dict__)
+        return super().prepare(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """ Enqueues a record according to the full-queue policy
+        """
+        if self.policy == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class FlushingQueueListener(logging.handlers.QueueListener):
+    """ Queue listener that drains every pending record on stop
+    """
+
+    def enqueue_sentinel(self) -> None:
+        """ Waits for room in a full queue instead of failing on stop
+        """
+        self.queue.put(self._sentinel)
+
+
+def get_logger(asynchronous: bool = False, queue_size: int = QUEUE_SIZE,
+               policy: str = 'block', structured: str = None
+               ) -> logging.Logger:
+    """
+    function that returns the "user_data" logging.Logger object
+    Args:
+      asynchronous(bool): when True, records are put on a bounded queue and
+        redacted and written by a background listener thread
+      queue_size(int): the maximum number of pending records
+      policy(str): 'block' to wait or 'drop' to discard when the queue is full
+      structured(str): 'text' or 'json' to mask mapping arguments before
+        formatting with StructuredRedactingFormatter
     """
     # create logger
     logger = logging.getLogger("user_data")
@@ -59,10 +252,23 @@ def get_logger() -> logging.Logger:
 
     # create console handler and set level to info
     ch = logging.StreamHandler()
-    ch_format = RedactingFormatter(list(PII_FIELDS))
+    if structured is None:
+        ch_format = RedactingFormatter(list(PII_FIELDS))
+    else:
+        ch_format = StructuredRedactingFormatter(list(PII_FIELDS), structured)
     ch.setFormatter(ch_format)
     ch.setLevel(logging.INFO)
 
+    if asynchronous:
+        # move redaction and I/O to a listener thread, flushed at exit
+        log_queue = queue.Queue(maxsize=queue_size)
+        listener = FlushingQueueListener(log_queue, ch,
+                                         respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        ch = BoundedQueueHandler(log_queue, policy)
+        ch.setLevel(logging.INFO)
+
     # add ch to logger
     logger.addHandler(ch)
 
@@ -72,36 +278,246 @@ def get_logger() -> logging.Logger:
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
-    """ function that returns a connector to the database """
-    host: str = os.environ.get('PERSONAL_DATA_DB_HOST', 'localhost'),
-    database: str = os.environ.get('PERSONAL_DATA_DB_NAME', 'root'),
-    user: str = os.environ.get('PERSONAL_DATA_DB_USERNAME'),
-    password: str = os.environ.get('PERSONAL_DATA_DB_PASSWORD', '')
-    return mysql.connector.connect(host, database, user, password)
+def _connect() -> mysql.connector.connection.MySQLConnection:
+    """ function that opens a new connection to the database """
+    return mysql.connector.connect(
+        host=os.environ.get('PERSONAL_DATA_DB_HOST', 'localhost'),
+        database=os.environ.get('PERSONAL_DATA_DB_NAME', 'root'),
+        user=os.environ.get('PERSONAL_DATA_DB_USERNAME'),
+        password=os.environ.get('PERSONAL_DATA_DB_PASSWORD', ''))
+
+
+def get_pool() -> ConnectionPool:
+    """
+    function that returns the process wide database connection pool
+    configured by PERSONAL_DATA_DB_POOL_SIZE and PERSONAL_DATA_DB_POOL_TIMEOUT
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        # a forked worker must not share its parent's sockets
+        if _pool is None or _pool_pid != os.getpid():
+            _pool_pid = os.getpid()
+            _pool = ConnectionPool(
+                _connect,
+                size=int(os.environ.get('PERSONAL_DATA_DB_POOL_SIZE', 5)),
+                timeout=float(
+                    os.environ.get('PERSONAL_DATA_DB_POOL_TIMEOUT', 30)))
+        return _pool
+
+
+def get_db() -> PooledConnection:
+    """
+    function that returns a connector to the database
+    The connection comes from the pool and goes back to it on close()
+    """
+    return get_pool().get()
+
+
+def row_template(columns: Sequence[str]) -> str:
+    """
+    Returns the %-style template rendering a row as a `field=value;`
+    log message, built once per result set
+    Args:
+      columns(list): the column names of the rows
+    """
+    return ' '.join('{}=%s;'.format(column.replace('%', '%%'))
+                    for column in columns)
+
+
+def stream_rows(cursor, batch_size: int = BATCH_SIZE) -> Iterator[List]:
+    """
+    Yields the rows of an executed query in batches of batch_size rows
+    so that the full result set is never held in memory
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def select_users(columns: Sequence[str] = None) -> Tuple[str, tuple]:
+    """
+    Returns the query, and its parameters, selecting columns from users
+    PII columns are masked by the database itself: a constant redaction
+    is selected in their place, so their values never leave the server
+    Args:
+      columns(list): the output columns, every column when None
+    """
+    if columns is None:
+        return "SELECT * FROM users", ()
+    if not columns:
+        raise ValueError("No column to export")
+    selected, params = [], []
+    for column in columns:
+        if not COLUMN_NAME.match(column):
+            raise ValueError("Invalid column name: {}".format(column))
+        if column in PII_FIELDS:
+            selected.append("%s AS `{}`".format(column))
+            params.append(RedactingFormatter.REDACTION)
+        else:
+            selected.append("`{}`".format(column))
+    return "SELECT {} FROM users".format(', '.join(selected)), tuple(params)
+
+
+def _log_rows(cursor, logger: logging.Logger, batch_size: int = BATCH_SIZE,
+              mask: bool = True,
+              row_filter: Callable[[Sequence], bool] = None) -> int:
+    """
+    Streams the rows of an executed query to the logger
+    Rows are read batch_size rows at a time and each batch is masked by
+    column, unless the query already masked it (mask=False), and emitted
+    before the next one is fetched. Rows for which row_filter, called on
+    the rows as read, returns False are not logged
+    Returns:
+      the number of rows logged
+    """
+    columns = cursor.column_names
+    template = row_template(columns)
+    count = 0
+    for rows in stream_rows(cursor, batch_size):
+        if row_filter is not None:
+            rows = [row for row in rows if row_filter(row)]
+        if mask:
+            rows = redact_rows(columns, rows, PII_FIELDS,
+                               RedactingFormatter.REDACTION)
+        for row in rows:
+            logger.info(template, *row, extra={'redacted': True})
+        count += len(rows)
+    return count
+
+
+def export_users(db, logger: logging.Logger, batch_size: int = BATCH_SIZE,
+                 columns: Sequence[str] = None) -> int:
+    """
+    Streams every row of the users table to the logger
+    Rows are read through an unbuffered cursor so that the table is never
+    held in memory
+    Args:
+      columns(list): the columns to export, PII ones being masked in SQL;
+        every column, masked in Python, when None
+    Returns:
+      the number of rows exported
+    """
+    query, params = select_users(columns)
+    cursor = db.cursor(buffered=False)
+    try:
+        cursor.execute(query, params)
+        return _log_rows(cursor, logger, batch_size, columns is None)
+    finally:
+        cursor.close()
+
+
+def row_digest(row: Sequence) -> str:
+    """ Returns a fingerprint of a row as read from the database """
+    return hashlib.sha1(repr(tuple(row)).encode('utf-8')).hexdigest()
+
+
+def load_watermark(state_file: str) -> Tuple[Optional[datetime], Set[str]]:
+    """
+    Returns the last_login high-water mark stored in state_file, None
+    when no export ran yet, and the digests of the rows exported at it
+    """
+    try:
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None, set()
+    value = state.get('last_login')
+    return (datetime.fromisoformat(value) if value else None,
+            set(state.get('rows', ())))
+
+
+def save_watermark(state_file: str, watermark: datetime,
+                   rows: Iterable[str] = ()) -> None:
+    """
+    Stores the last_login high-water mark in state_file, with the digests
+    of the rows exported at it
+    The file is replaced atomically so a crash never leaves it truncated
+    """
+    tmp_file = '{}.tmp'.format(state_file)
+    with open(tmp_file, 'w') as f:
+        json.dump({'last_login': watermark.isoformat(),
+                   'rows': sorted(rows)}, f)
+    os.replace(tmp_file, state_file)
+
+
+def export_users_since(db, logger: logging.Logger, state_file: str,
+                       batch_size: int = BATCH_SIZE,
+                       columns: Sequence[str] = None) -> int:
+    """
+    Streams the users whose last_login is past the stored high-water mark
+    then moves the mark to the latest exported last_login
+    last_login has a one second resolution, so rows of the mark's second
+    are read again and the ones already exported, remembered by digest,
+    are skipped: rows reaching that second after the export are not lost
+    The first run, without a stored mark, exports the whole table
+    Args:
+      columns(list): the columns to export, as for export_users, they
+        must include last_login
+    Returns:
+      the number of rows exported
+    """
+    if columns is not None and 'last_login' not in columns:
+        raise ValueError("last_login is required to track the watermark")
+    watermark, seen = load_watermark(state_file)
+    query, params = select_users(columns)
+    if watermark is not None:
+        query += " WHERE last_login >= %s"
+        params += (watermark,)
+    boundary = {'last_login': watermark, 'rows': set(seen)}
+    index = None
+
+    def _new_row(row: Sequence) -> bool:
+        """ Tracks the rows of the latest second, skips the ones already
+        exported at the stored mark
+        """
+        digest = row_digest(row)
+        if row[index] != boundary['last_login']:
+            boundary['last_login'], boundary['rows'] = row[index], set()
+        elif row[index] == watermark and digest in seen:
+            return False
+        boundary['rows'].add(digest)
+        return True
+
+    cursor = db.cursor(buffered=False)
+    try:
+        cursor.execute(query + " ORDER BY last_login", params)
+        index = cursor.column_names.index('last_login')
+        count = _log_rows(cursor, logger, batch_size, columns is None,
+                          _new_row)
+    finally:
+        cursor.close()
+    if boundary['last_login'] is not None:
+        save_watermark(state_file, boundary['last_login'], boundary['rows'])
+    return count
 
 
 def main():
     """
     Function to retrieve all rows in the users table and
     display each row under a filtered format
+    Setting PERSONAL_DATA_WATERMARK_FILE only exports the rows changed since
+    the previous run, and PERSONAL_DATA_EXPORT_COLUMNS (comma separated)
+    restricts the export to those columns with PII masked by the database
     """
+    batch_size = int(os.environ.get('PERSONAL_DATA_BATCH_SIZE', BATCH_SIZE))
+    state_file = os.environ.get('PERSONAL_DATA_WATERMARK_FILE')
+    columns = os.environ.get('PERSONAL_DATA_EXPORT_COLUMNS')
+    if columns:
+        columns = [column.strip() for column in columns.split(',')]
+    else:
+        columns = None
     db_connection = get_db()
-    # Create a cursor
-    cursor = db_connection.cursor()
-
-    # Execute a query to retrieve all rows from the users table
-    cursor.execute("SELECT * FROM users")
-
-    # Fetch all rows
-    rows = cursor.fetchall()
     logger = get_logger()
-
-    for row in rows:
-        logger.info(
-            "name=%s; email=%s; phone=%s; ssn=%s; password=%s; ip=%s; \
-              last_login=%s; user_agent=%s", row[0], row[1], row[2],
-            row[3], row[4], row[5], row[6], row[7])
+    try:
+        if state_file:
+            export_users_since(db_connection, logger, state_file, batch_size,
+                               columns)
+        else:
+            export_users(db_connection, logger, batch_size, columns)
+    finally:
+        db_connection.close()
 
 
 if __name__ == "__main__":
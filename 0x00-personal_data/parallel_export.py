@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Module parallel_export
+Exports the users table redacted, in parallel over last_login ranges
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+from datetime import datetime
+from typing import List, Optional, Tuple
+from filtered_logger import (BATCH_SIZE, PII_FIELDS, RedactingFormatter,
+                             get_db, redact_rows, row_template, stream_rows)
+
+Partition = Tuple[int, Optional[datetime], Optional[datetime], bool]
+
+
+def partition_users(db, partitions: int) -> List[Partition]:
+    """
+    Splits the users table into contiguous last_login ranges
+    Returns:
+      a list of (index, lower bound, upper bound, is last) tuples, the
+      lower bound being inclusive and the upper bound exclusive except for
+      the last range. Bounds are None when the table has no last_login.
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT MIN(last_login), MAX(last_login) FROM users")
+        low, high = cursor.fetchone()
+    finally:
+        cursor.close()
+    if low is None or low == high or partitions < 2:
+        return [(0, None, None, True)]
+    step = (high - low) / partitions
+    bounds = [low + step * i for i in range(partitions)] + [high]
+    return [(i, bounds[i], bounds[i + 1], i == partitions - 1)
+            for i in range(partitions)]
+
+
+def partition_query(partition: Partition) -> Tuple[str, tuple]:
+    """
+    Returns the query and parameters selecting the rows of a partition
+    Rows without last_login belong to the first partition
+    """
+    index, low, high, last = partition
+    if low is None:
+        return "SELECT * FROM users", ()
+    condition = "last_login >= %s AND last_login {} %s".format(
+        '<=' if last else '<')
+    if index == 0:
+        condition = "({}) OR last_login IS NULL".format(condition)
+    query = "SELECT * FROM users WHERE {} ORDER BY last_login".format(
+        condition)
+    return query, (low, high)
+
+
+def shard_path(output_dir: str, prefix: str, index: int) -> str:
+    """ Returns the output file of a partition """
+    return os.path.join(output_dir, "{}.{:04d}.log".format(prefix, index))
+
+
+def export_partition(job: Tuple[Partition, str, int]) -> Tuple[str, int]:
+    """
+    Worker: fetches, redacts and writes one partition to its shard
+    Returns:
+      the shard path and the number of rows written
+    """
+    partition, path, batch_size = job
+    formatter = RedactingFormatter(list(PII_FIELDS))
+    query, params = partition_query(partition)
+    count = 0
+    db = get_db()
+    try:
+        cursor = db.cursor(buffered=False)
+        try:
+            cursor.execute(query, params)
+            columns = cursor.column_names
+            with open(path, 'w') as shard:
+                template = row_template(columns)
+                for rows in stream_rows(cursor, batch_size):
+                    lines = []
+                    for row in redact_rows(columns, rows, PII_FIELDS,
+                                           formatter.REDACTION):
+                        record = logging.LogRecord(
+                            "user_data", logging.INFO, __file__, 0,
+                            template, tuple(row), None)
+                        record.redacted = True
+                        lines.append(formatter.format(record))
+                    shard.write('\n'.join(lines) + '\n')
+                    count += len(rows)
+        finally:
+            cursor.close()
+    finally:
+        db.close()
+    return path, count
+
+
+def export(workers: int, partitions: int, output_dir: str, prefix: str,
+           batch_size: int = BATCH_SIZE, merge: str = None) -> int:
+    """
+    Exports the users table with a pool of worker processes
+    Each partition is written to its own shard. When merge is set, shards
+    are appended in partition order to that file ('-' for stdout) as soon
+    as they complete, then removed.
+    Returns:
+      the number of rows exported
+    """
+    db = get_db()
+    try:
+        ranges = partition_users(db, partitions)
+    finally:
+        db.close()
+    jobs = [(partition, shard_path(output_dir, prefix, partition[0]),
+             batch_size) for partition in ranges]
+    total = 0
+    out = None
+    if merge == '-':
+        out = sys.stdout
+    elif merge is not None:
+        out = open(merge, 'w')
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for path, count in pool.imap(export_partition, jobs):
+                total += count
+                if out is not None:
+                    with open(path) as shard:
+                        shutil.copyfileobj(shard, out)
+                    os.remove(path)
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+    return total
+
+
+def main() -> None:
+    """ Parses the command line and runs the export """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-w', '--workers', type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument('-p', '--partitions', type=int, default=None,
+                        help="number of last_login ranges "
+                             "(default: 4 per worker)")
+    parser.add_argument('-b', '--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('-o', '--output-dir', default='.')
+    parser.add_argument('--prefix', default='users')
+    parser.add_argument('-m', '--merge', default=None,
+                        help="merge shards in order into this file "
+                             "('-' for stdout)")
+    args = parser.parse_args()
+    partitions = args.partitions or args.workers * 4
+    total = export(args.workers, partitions, args.output_dir, args.prefix,
+                   args.batch_size, args.merge)
+    print("{} rows exported".format(total), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
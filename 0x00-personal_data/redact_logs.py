@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Module redact_logs
+Redacts PII fields from existing log files using every core
+"""
+import argparse
+import collections
+import mmap
+import multiprocessing
+import os
+import sys
+from typing import Iterator, List, Tuple
+from filtered_logger import PII_FIELDS, RedactingFormatter, redactor
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+_mapped = None
+_redact = None
+
+
+def chunk_bounds(mapped: mmap.mmap,
+                 chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, int]]:
+    """
+    Yields (start, end) offsets of chunks of about chunk_size bytes
+    Every chunk but the last ends right after a newline
+    """
+    start, size = 0, len(mapped)
+    while start < size:
+        end = mapped.find(b'\n', min(start + chunk_size, size) - 1)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def _init_worker(path: str, fields: List[str], redaction: str,
+                 separator: str) -> None:
+    """ Maps the input file and builds the redactor once per worker """
+    global _mapped, _redact
+    with open(path, 'rb') as f:
+        _mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _redact = redactor(fields, redaction, separator)
+
+
+def redact_chunk(bounds: Tuple[int, int]) -> bytes:
+    """
+    Worker: redacts the lines between the given offsets
+    Undecodable bytes are carried through unchanged
+    """
+    start, end = bounds
+    text = _mapped[start:end].decode('utf-8', 'surrogateescape')
+    return _redact(text).encode('utf-8', 'surrogateescape')
+
+
+def redact_file(path: str, out, fields: List[str],
+                redaction: str = RedactingFormatter.REDACTION,
+                separator: str = RedactingFormatter.SEPARATOR,
+                workers: int = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Redacts the log file at path into the binary stream out
+    Chunks are redacted by a pool of worker processes and written in
+    their original order. At most 2 chunks per worker are submitted ahead
+    of the writer, so a slow output doesn't pile results up in memory
+    Returns:
+      the number of bytes read
+    """
+    if os.path.getsize(path) == 0:
+        return 0
+    workers = workers or os.cpu_count() or 1
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        pending = collections.deque()
+        with multiprocessing.Pool(
+                workers, _init_worker,
+                (path, fields, redaction, separator)) as pool:
+            for bounds in chunk_bounds(mapped, chunk_size):
+                if len(pending) >= workers * 2:
+                    out.write(pending.popleft().get())
+                pending.append(pool.apply_async(redact_chunk, (bounds,)))
+            while pending:
+                out.write(pending.popleft().get())
+        return len(mapped)
+    finally:
+        mapped.close()
+
+
+def main() -> None:
+    """ Parses the command line and redacts the file """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('input', help="the log file to redact")
+    parser.add_argument('-o', '--output', default='-',
+                        help="the redacted file ('-' for stdout)")
+    parser.add_argument('-f', '--fields', nargs='+', default=PII_FIELDS,
+                        help="the fields to redact")
+    parser.add_argument('-r', '--redaction',
+                        default=RedactingFormatter.REDACTION)
+    parser.add_argument('-s', '--separator',
+                        default=RedactingFormatter.SEPARATOR)
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('-c', '--chunk-size', type=int,
+                        default=CHUNK_SIZE // (1024 * 1024),
+                        help="chunk size in MiB")
+    args = parser.parse_args()
+
+    if args.output == '-':
+        out = sys.stdout.buffer
+    else:
+        out = open(args.output, 'wb')
+    try:
+        redact_file(args.input, out, list(args.fields), args.redaction,
+                    args.separator, args.workers,
+                    args.chunk_size * 1024 * 1024)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,13 +5,81 @@ Implements class BasicAuth that inherits from Auth class
 """
 from api.v1.auth.auth import Auth
 import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
 from typing import TypeVar
 from models.user import User
 
 
+class CredentialCache:
+    """
+    Bounded LRU cache of recently verified Authorization headers
+    Headers are keyed by their HMAC under a per-process secret and map to
+    the user id, the password hash they were verified against and an
+    expiry time. An entry is dropped once the user is removed or changes
+    password, so repeated requests skip the lookup and the hashing.
+    """
+
+    def __init__(self, size: int = 1024, ttl: float = 60.0):
+        """ Initialize the cache
+        Args:
+          - size: the maximum number of entries, 0 disables the cache
+          - ttl: the lifetime of an entry in seconds
+        """
+        self.size = size
+        self.ttl = ttl
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, header: str) -> bytes:
+        """ Keyed hash of an Authorization header """
+        return hmac.new(self._secret, header.encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def get(self, header: str) -> TypeVar('User'):
+        """ Returns the user verified for header, None on a miss """
+        if self.size <= 0 or header is None:
+            return None
+        key = self._key(header)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user_id, password, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        user = User.get(user_id)
+        if user is None or user.password != password:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        return user
+
+    def put(self, header: str, user: TypeVar('User')):
+        """ Records that header authenticates user """
+        if self.size <= 0 or header is None:
+            return
+        key = self._key(header)
+        entry = (user.id, user.password, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
 class BasicAuth(Auth):
     """
     Implementation of basic authentication
+    Verified headers are kept in credential_cache, sized by the
+    BASIC_AUTH_CACHE_SIZE and BASIC_AUTH_CACHE_TTL environment variables
     Methods:
       - extract_base64_authorization_header()
       - decode_base64_authorization_header()
@@ -19,6 +87,9 @@ class BasicAuth(Auth):
       - user_object_from_credentials()
       - current_user()
     """
+    credential_cache = CredentialCache(
+        int(os.getenv('BASIC_AUTH_CACHE_SIZE', 1024)),
+        float(os.getenv('BASIC_AUTH_CACHE_TTL', 60)))
 
     def extract_base64_authorization_header(
             self, authorization_header: str) -> str:
@@ -88,7 +159,13 @@ class BasicAuth(Auth):
     def current_user(self, request=None) -> TypeVar('User'):
         """ retrieves the User instance for a request """
         header = self.authorization_header(request)
+        user = self.credential_cache.get(header)
+        if user is not None:
+            return user
         authorization = self.extract_base64_authorization_header(header)
         decode = self.decode_base64_authorization_header(authorization)
         credential = self.extract_user_credentials(decode)
-        return self.user_object_from_credentials(credential[0], credential[1])
+        user = self.user_object_from_credentials(credential[0], credential[1])
+        if user is not None:
+            self.credential_cache.put(header, user)
+        return user
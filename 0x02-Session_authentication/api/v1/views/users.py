@@ -2,18 +2,60 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request
 from models.user import User
+from typing import Iterable, Iterator
+import json
+
+
+def stream_users(users: Iterable[User]) -> Iterator[str]:
+    """ Yield a JSON array of users one element at a time
+    """
+    separator = '['
+    for user in users:
+        yield separator + json.dumps(user.to_json())
+        separator = ','
+    yield '[]' if separator == '[' else ']'
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters (optional):
+      - limit: maximum number of users returned
+      - after: cursor, the ID of the last user of the previous page
+      - stream: 1 to send the array as it is built
     Return:
-      - list of all User objects JSON represented
+      - list of all User objects JSON represented, ordered by ID when
+        paginated; the X-Next-Cursor header holds the cursor of the next
+        page, if any
+      - 400 if limit is not a positive integer
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    stream = request.args.get('stream') == '1'
+    if limit is None and after is None and not stream:
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            return jsonify({'error': "limit must be a positive integer"}), 400
+    headers = {}
+    if limit is not None:
+        users = list(User.iterate(after, limit + 1))
+        if len(users) > limit:
+            users = users[:limit]
+            headers['X-Next-Cursor'] = users[-1].id
+    else:
+        users = User.iterate(after)
+    if stream:
+        return Response(stream_users(users), mimetype='application/json',
+                        headers=headers)
+    return jsonify([user.to_json() for user in users]), 200, headers
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -1,21 +1,353 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from glob import escape, glob
+from itertools import islice
+from time import monotonic, sleep
+from typing import TypeVar, List, Iterable, Iterator, Optional
+from os import fsync, getenv, path, remove, rename, replace
+from threading import Condition, RLock, Thread, get_ident, local
+from models.query import (RANGE_LOOKUPS, matcher, predicates,
+                          prefix_upper_bound)
+from models.sqlite_storage import SQLiteStorage
+import atexit
+import heapq
 import json
+import logging
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
+# sorted ids of each class for iterate(), built on first use and kept up
+# to date by save() and remove()
+SORTED_IDS = {}
+ITERATE_CHUNK = 100
+
+# lazy loading keeps the records read by load_from_file() in RAW and only
+# builds an object on its first get() or search() hit
+LAZY_LOAD = getenv('MODELS_LAZY_LOAD', '0') == '1'
+RAW = {}
+
+# 'snapshot' rewrites .db_<Class>.json on every change, 'journal' appends
+# the change to .db_<Class>.journal and compacts it in the background
+STORAGE_MODE = getenv('MODELS_STORAGE_MODE', 'snapshot')
+JOURNAL_THRESHOLD = int(getenv('MODELS_JOURNAL_THRESHOLD', 1000))
+STORAGE_LOCK = RLock()
+JOURNALS = {}
+JOURNAL_RECORDS = {}
+COMPACTING = set()
+COMPACTIONS = {}
+SNAPSHOTS = {}
+
+# group commit: flushes requested within GROUP_COMMIT_WINDOW seconds, or
+# until GROUP_COMMIT_SIZE changes are pending, are written together
+GROUP_COMMIT_WINDOW = float(getenv('MODELS_GROUP_COMMIT_MS', 0)) / 1000
+GROUP_COMMIT_SIZE = int(getenv('MODELS_GROUP_COMMIT_SIZE', 100))
+GROUP = {'pending': {}, 'size': 0, 'batch': 0, 'flushed': -1,
+         'leader': False, 'error': (None, None)}
+GROUP_CONDITION = Condition()
+UNIT_OF_WORK = local()
+
+# snapshots are written atomically (temporary file, fsync, rename).
+# DURABILITY 'sync' writes them on the calling thread, 'interval' from a
+# background thread every FLUSH_INTERVAL seconds, 'shutdown' at exit only
+DURABILITY = getenv('MODELS_DURABILITY', 'sync')
+FLUSH_INTERVAL = float(getenv('MODELS_FLUSH_INTERVAL', 1))
+DIRTY = set()
+FLUSHER = {'thread': None}
+LOGGER = logging.getLogger(__name__)
+
+# 'json' keeps the objects in DATA and persists them to .db_<Class>.json,
+# 'sqlite' reads and writes them straight from the SQLite database at
+# MODELS_SQLITE_PATH, shared by every process, without caching them
+STORAGE_BACKEND = getenv('MODELS_STORAGE_BACKEND', 'json')
+STORAGE = None
+if STORAGE_BACKEND == 'sqlite':
+    STORAGE = SQLiteStorage(getenv('MODELS_SQLITE_PATH', '.db.sqlite3'),
+                            TIMESTAMP_FORMAT,
+                            float(getenv('MODELS_SQLITE_TIMEOUT', 5)))
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string, through the fast ISO 8601 parser
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def _dump_snapshot(file_path: str, objs_json: dict) -> str:
+    """ Write objs_json to a temporary file next to file_path and sync it
+    to disk. Returns the temporary path, to be renamed over file_path
+    """
+    tmp_path = "{}.{}.tmp".format(file_path, get_ident())
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(objs_json, f)
+            f.flush()
+            fsync(f.fileno())
+    except BaseException:
+        remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def _flush_class(cls: type):
+    """ Write the snapshot of cls if it changed since its last write. It
+    stays dirty if the write fails
+    """
+    with STORAGE_LOCK:
+        if cls not in DIRTY:
+            return
+        DIRTY.discard(cls)
+    try:
+        cls.save_to_file()
+    except BaseException:
+        with STORAGE_LOCK:
+            DIRTY.add(cls)
+        raise
+
+
+def flush():
+    """ Write the snapshot of every class changed since its last write
+    Classes whose write fails stay dirty; the first error is raised once
+    every class was tried
+    """
+    with STORAGE_LOCK:
+        dirty = list(DIRTY)
+    error = None
+    for cls in dirty:
+        try:
+            _flush_class(cls)
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+
+
+def shutdown():
+    """ Wait for the background compactions, then write every dirty
+    snapshot. Run at exit
+    """
+    with STORAGE_LOCK:
+        compactions = list(COMPACTIONS.values())
+    for compaction in compactions:
+        compaction.join()
+    flush()
+
+
+atexit.register(shutdown)
+
+
+def _flush_periodically():
+    """ Background flusher: write dirty snapshots every FLUSH_INTERVAL
+    """
+    while True:
+        sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            LOGGER.exception("Snapshot flush failed, retrying in %ss",
+                             FLUSH_INTERVAL)
+
+
+def _start_flusher():
+    """ Start the background flusher thread once
+    """
+    with STORAGE_LOCK:
+        if FLUSHER['thread'] is not None:
+            return
+        FLUSHER['thread'] = Thread(target=_flush_periodically, daemon=True)
+        FLUSHER['thread'].start()
+
+
+def _collect(pending: dict, cls: type, upserts: Iterable,
+             deletes: Iterable[str]) -> int:
+    """ Merge changes of cls into pending, the last change of an object
+    wins. Returns the number of changes merged
+    """
+    entry = pending.setdefault(cls.__name__, (cls, {}, set()))
+    count = 0
+    for obj in upserts:
+        entry[1][obj.id] = obj
+        entry[2].discard(obj.id)
+        count += 1
+    for obj_id in deletes:
+        entry[1].pop(obj_id, None)
+        entry[2].add(obj_id)
+        count += 1
+    return count
+
+
+def _flush(pending: dict):
+    """ Write the changes collected in pending, once per class
+    """
+    for cls, upserts, deletes in pending.values():
+        cls._write(upserts.values(), deletes)
+
+
+class Index():
+    """ Index of one attribute: value -> ids of the objects
+    Range lookups bisect the sorted values, kept up to date as values are
+    added and removed. Values that can't be ordered together turn range
+    lookups off until the index is cleared
+    Every method holds the index lock, so the index can be changed and
+    read by several threads
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on attribute
+        """
+        self.attribute = attribute
+        self._ids = {}
+        self._values = {}
+        self._sorted = []
+        self._lock = RLock()
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index obj under its current attribute value
+        """
+        self.add_value(obj.id, getattr(obj, self.attribute, None))
+
+    def add_value(self, obj_id: str, value):
+        """ Index obj_id under value
+        """
+        with self._lock:
+            self.discard(obj_id)
+            try:
+                ids = self._ids.get(value)
+            except TypeError:
+                return
+            if ids is None:
+                ids = self._ids[value] = {}
+                self._sort_add(value)
+            ids[obj_id] = None
+            self._values[obj_id] = value
+
+    def discard(self, obj_id: str):
+        """ Remove obj_id from the index
+        """
+        with self._lock:
+            if obj_id not in self._values:
+                return
+            value = self._values.pop(obj_id)
+            ids = self._ids[value]
+            del ids[obj_id]
+            if not ids:
+                del self._ids[value]
+                self._sort_discard(value)
+
+    def _sort_add(self, value):
+        """ Insert a new value in the sorted values
+        """
+        if value is None or self._sorted is None:
+            return
+        try:
+            insort(self._sorted, value)
+        except TypeError:
+            self._sorted = None
+
+    def _sort_discard(self, value):
+        """ Remove a value from the sorted values
+        """
+        if value is None or self._sorted is None:
+            return
+        try:
+            i = bisect_left(self._sorted, value)
+        except TypeError:
+            self._sorted = None
+            return
+        if i < len(self._sorted) and self._sorted[i] == value:
+            del self._sorted[i]
+
+    def lookup(self, value) -> Optional[List[str]]:
+        """ Ids of the objects indexed under value, None if the index
+        can't answer (unhashable value)
+        """
+        with self._lock:
+            try:
+                return list(self._ids.get(value, ()))
+            except TypeError:
+                return None
+
+    def lookup_in(self, values) -> Optional[List[str]]:
+        """ Ids of the objects indexed under any of values, None if the
+        index can't answer
+        """
+        try:
+            values = set(values)
+        except TypeError:
+            return None
+        result = []
+        with self._lock:
+            for value in values:
+                ids = self.lookup(value)
+                if ids is None:
+                    return None
+                result.extend(ids)
+        return result
+
+    def lookup_range(self, lookup: str, value) -> Optional[List[str]]:
+        """ Ids of the objects whose value matches a range lookup (gt, gte,
+        lt, lte or startswith), None if the index can't answer (values
+        not comparable)
+        """
+        with self._lock:
+            keys = self._sorted
+            if keys is None:
+                return None
+            try:
+                start, stop = 0, len(keys)
+                if lookup == 'startswith':
+                    if not isinstance(value, str):
+                        return None
+                    start = bisect_left(keys, value)
+                    upper = prefix_upper_bound(value)
+                    if upper is not None:
+                        stop = bisect_left(keys, upper)
+                elif lookup == 'gt':
+                    start = bisect_right(keys, value)
+                elif lookup == 'gte':
+                    start = bisect_left(keys, value)
+                elif lookup == 'lt':
+                    stop = bisect_left(keys, value)
+                else:
+                    stop = bisect_right(keys, value)
+            except TypeError:
+                return None
+            return [obj_id for key in keys[start:stop]
+                    for obj_id in self._ids[key]]
+
+    def clear(self):
+        """ Empty the index
+        """
+        with self._lock:
+            self._ids.clear()
+            self._values.clear()
+            self._sorted = []
 
 
 class Base():
     """ Base class
+    Attributes listed in indexed_attributes get an equality index, kept up
+    to date on save(), remove() and load_from_file(), that search() uses
+    instead of scanning every object
+    Subclasses declaring __slots__ for all their attributes get a compact,
+    dict-less instance layout; subclasses without __slots__ keep a __dict__
+    With the SQLite backend (STORAGE), objects live in the database only:
+    every read builds fresh objects and indexed_attributes become indexed
+    columns
     """
 
+    __slots__ = ('id', 'created_at', 'updated_at')
+    indexed_attributes = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
@@ -25,13 +357,11 @@ class Base():
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -48,7 +378,7 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,56 +387,425 @@ class Base():
                 result[key] = value
         return result
 
+    @classmethod
+    def _slot_names(cls) -> List[str]:
+        """ Names of the slots of the class, base classes first
+        """
+        names = cls.__dict__.get('_slot_names_cache')
+        if names is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                for name in klass.__dict__.get('__slots__', ()):
+                    if name not in ('__dict__', '__weakref__') and \
+                            name not in names:
+                        names.append(name)
+            setattr(cls, '_slot_names_cache', names)
+        return names
+
+    def _attributes(self) -> Iterator[tuple]:
+        """ (name, value) of every attribute set, slots first, then the
+        __dict__ of classes that have one
+        """
+        for name in self._slot_names():
+            try:
+                yield name, getattr(self, name)
+            except AttributeError:
+                continue
+        yield from getattr(self, '__dict__', {}).items()
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
+        In journal mode, the journal records are replayed on top of the
+        snapshot, and folded into a new one if a compaction was cut short.
+        With LAZY_LOAD, records are kept raw until first used
+        Changes not flushed yet are written first
         """
+        _flush_class(cls)
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
         DATA[s_class] = {}
-        if not path.exists(file_path):
+        RAW[s_class] = {}
+        SORTED_IDS.pop(s_class, None)
+        if STORAGE is not None:
+            STORAGE.load(cls)
             return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        # temporary snapshots left by an interrupted write
+        for tmp_path in glob(escape(file_path) + ".*.tmp"):
+            remove(tmp_path)
+        if path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+            if LAZY_LOAD:
+                RAW[s_class] = objs_json
+            else:
+                for obj_id, obj_json in objs_json.items():
+                    DATA[s_class][obj_id] = cls(**obj_json)
+        if STORAGE_MODE == 'journal':
+            cls._replay_journal()
+        cls._reindex()
+        if STORAGE_MODE == 'journal' and \
+                path.exists(cls._journal_paths()[0]):
+            cls.save_to_file()
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
+        The objects are serialized and written outside STORAGE_LOCK; the
+        snapshot only replaces the file if no newer one was started
+        meanwhile. In journal mode the snapshot includes every change, so
+        it is written under the lock and the journal is emptied
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        if STORAGE is not None:
+            return
+        if STORAGE_MODE == 'journal':
+            with STORAGE_LOCK:
+                SNAPSHOTS[s_class] = SNAPSHOTS.get(s_class, 0) + 1
+                objs_json = dict(RAW.get(s_class, {}))
+                for obj_id, obj in list(DATA[s_class].items()):
+                    objs_json[obj_id] = obj.to_json(True)
+                replace(_dump_snapshot(file_path, objs_json), file_path)
+                cls._close_journal()
+                for journal_path in cls._journal_paths():
+                    if path.exists(journal_path):
+                        remove(journal_path)
+            return
+        with STORAGE_LOCK:
+            SNAPSHOTS[s_class] = SNAPSHOTS.get(s_class, 0) + 1
+            snapshot = SNAPSHOTS[s_class]
+            objs = list(DATA[s_class].values())
+            objs_json = dict(RAW.get(s_class, {}))
+        for obj in objs:
+            objs_json[obj.id] = obj.to_json(True)
+        tmp_path = _dump_snapshot(file_path, objs_json)
+        with STORAGE_LOCK:
+            if SNAPSHOTS[s_class] == snapshot:
+                replace(tmp_path, file_path)
+                return
+        remove(tmp_path)
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _journal_paths(cls) -> List[str]:
+        """ Paths of the journal being compacted and of the current one,
+        in replay order
+        """
+        journal_path = ".db_{}.journal".format(cls.__name__)
+        return ["{}.old".format(journal_path), journal_path]
+
+    @classmethod
+    def _replay_journal(cls):
+        """ Apply the journal records to DATA
+        """
+        s_class = cls.__name__
+        records = 0
+        for journal_path in cls._journal_paths():
+            if not path.exists(journal_path):
+                continue
+            with open(journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # torn write of the last record
+                        break
+                    if record['op'] == 'upsert' and LAZY_LOAD:
+                        RAW[s_class][record['id']] = record['obj']
+                    elif record['op'] == 'upsert':
+                        DATA[s_class][record['id']] = cls(**record['obj'])
+                    else:
+                        DATA[s_class].pop(record['id'], None)
+                        RAW[s_class].pop(record['id'], None)
+                    records += 1
+        JOURNAL_RECORDS[s_class] = records
+
+    @classmethod
+    def _close_journal(cls):
+        """ Close the journal file of the class
+        """
+        journal = JOURNALS.pop(cls.__name__, None)
+        if journal is not None:
+            journal.close()
+        JOURNAL_RECORDS[cls.__name__] = 0
+
+    @classmethod
+    def _append_journal(cls, upserts: Iterable[TypeVar('Base')],
+                        deletes: Iterable[str]):
+        """ Append upsert and delete records to the journal, and start a
+        background compaction once it holds JOURNAL_THRESHOLD records
+        """
+        s_class = cls.__name__
+        lines = [json.dumps({'op': 'upsert', 'id': obj.id,
+                             'obj': obj.to_json(True)}) for obj in upserts]
+        lines += [json.dumps({'op': 'delete', 'id': obj_id})
+                  for obj_id in deletes]
+        with STORAGE_LOCK:
+            journal = JOURNALS.get(s_class)
+            if journal is None:
+                journal = open(cls._journal_paths()[1], 'a')
+                JOURNALS[s_class] = journal
+            journal.write('\n'.join(lines) + '\n')
+            journal.flush()
+            JOURNAL_RECORDS[s_class] = \
+                JOURNAL_RECORDS.get(s_class, 0) + len(lines)
+            if JOURNAL_RECORDS[s_class] < JOURNAL_THRESHOLD or \
+                    s_class in COMPACTING:
+                return
+            # rotate the journal, new records go to a fresh one
+            old_path, journal_path = cls._journal_paths()
+            cls._close_journal()
+            rename(journal_path, old_path)
+            COMPACTING.add(s_class)
+            SNAPSHOTS[s_class] = SNAPSHOTS.get(s_class, 0) + 1
+            objs = list(DATA[s_class].values())
+            raw = dict(RAW.get(s_class, {}))
+            compaction = Thread(target=cls._compact,
+                                args=(objs, raw, SNAPSHOTS[s_class]),
+                                daemon=True)
+            COMPACTIONS[s_class] = compaction
+            compaction.start()
+
+    @classmethod
+    def _compact(cls, objs: List[TypeVar('Base')], raw: dict,
+                 snapshot: int):
+        """ Write a snapshot of objs, then drop the rotated journal
+        Changes made meanwhile are in the current journal, replayed on top.
+        The snapshot is discarded if save_to_file() wrote a newer one.
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        try:
+            objs_json = raw
+            for obj in objs:
+                objs_json[obj.id] = obj.to_json(True)
+            tmp_path = _dump_snapshot(file_path, objs_json)
+            with STORAGE_LOCK:
+                if SNAPSHOTS[s_class] == snapshot:
+                    replace(tmp_path, file_path)
+                    remove(cls._journal_paths()[0])
+                else:
+                    remove(tmp_path)
+        finally:
+            with STORAGE_LOCK:
+                COMPACTING.discard(s_class)
+                COMPACTIONS.pop(s_class, None)
+
+    @classmethod
+    def _write(cls, upserts: Iterable[TypeVar('Base')] = (),
+               deletes: Iterable[str] = ()):
+        """ Write changed objects to storage: one transaction with the
+        SQLite backend, a journal append in journal mode, a full snapshot
+        otherwise. Unless DURABILITY is 'sync', the snapshot is left to the
+        background flusher or to the exit
+        """
+        if STORAGE is not None:
+            STORAGE.write(cls, upserts, deletes)
+        elif STORAGE_MODE == 'journal':
+            cls._append_journal(upserts, deletes)
+        elif DURABILITY == 'sync':
+            cls.save_to_file()
+        else:
+            with STORAGE_LOCK:
+                DIRTY.add(cls)
+            if DURABILITY == 'interval':
+                _start_flusher()
+
+    @classmethod
+    def _persist(cls, upserts: Iterable[TypeVar('Base')] = (),
+                 deletes: Iterable[str] = ()):
+        """ Persist changed objects: deferred to the end of the current
+        unit of work, merged into a group commit, or written right away
+        """
+        pending = getattr(UNIT_OF_WORK, 'pending', None)
+        if pending is not None:
+            _collect(pending, cls, upserts, deletes)
+        elif GROUP_COMMIT_WINDOW > 0:
+            cls._group_commit(upserts, deletes)
+        else:
+            cls._write(upserts, deletes)
+
+    @classmethod
+    def _group_commit(cls, upserts: Iterable[TypeVar('Base')],
+                      deletes: Iterable[str]):
+        """ Queue the changes for the next group commit and wait until
+        they are written. The first waiting thread leads the batch: it
+        waits for the window to close, or the batch to fill, and flushes
+        every change queued meanwhile
+        """
+        with GROUP_CONDITION:
+            GROUP['size'] += _collect(GROUP['pending'], cls, upserts,
+                                      deletes)
+            batch = GROUP['batch']
+            if GROUP['size'] >= GROUP_COMMIT_SIZE:
+                GROUP_CONDITION.notify_all()
+            while GROUP['flushed'] < batch and GROUP['leader']:
+                GROUP_CONDITION.wait()
+            if GROUP['flushed'] >= batch:
+                failed_batch, error = GROUP['error']
+                if failed_batch == batch:
+                    raise error
+                return
+            GROUP['leader'] = True
+            deadline = monotonic() + GROUP_COMMIT_WINDOW
+            while GROUP['size'] < GROUP_COMMIT_SIZE:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                GROUP_CONDITION.wait(remaining)
+            pending = GROUP['pending']
+            GROUP['pending'], GROUP['size'] = {}, 0
+            GROUP['batch'] += 1
+        error = None
+        try:
+            _flush(pending)
+        except Exception as e:
+            error = e
+        with GROUP_CONDITION:
+            if error is not None:
+                GROUP['error'] = (batch, error)
+            GROUP['flushed'] = batch
+            GROUP['leader'] = False
+            GROUP_CONDITION.notify_all()
+        if error is not None:
+            raise error
+
+    @classmethod
+    @contextmanager
+    def transaction(cls) -> Iterator[None]:
+        """ Unit of work: save() and remove() calls made by this thread
+        inside the block are written once, when the outermost block exits
+        Objects are updated in memory right away, the block only batches
+        their persistence
+        """
+        if getattr(UNIT_OF_WORK, 'pending', None) is not None:
+            yield
+            return
+        UNIT_OF_WORK.pending = {}
+        try:
+            yield
+        finally:
+            pending = UNIT_OF_WORK.pending
+            UNIT_OF_WORK.pending = None
+            _flush(pending)
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
+        if STORAGE is not None:
+            self.__class__._persist(upserts=[self])
+            return
         DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        RAW.get(s_class, {}).pop(self.id, None)
+        for index in self.__class__._indexes().values():
+            index.add(self)
+        with STORAGE_LOCK:
+            ids = SORTED_IDS.get(s_class)
+            if ids is not None:
+                i = bisect_left(ids, self.id)
+                if i == len(ids) or ids[i] != self.id:
+                    ids.insert(i, self.id)
+        self.__class__._persist(upserts=[self])
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
+        if STORAGE is not None:
+            self.__class__._persist(deletes=[self.id])
+            return
         if DATA[s_class].get(self.id) is not None:
             del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+            RAW.get(s_class, {}).pop(self.id, None)
+            for index in self.__class__._indexes().values():
+                index.discard(self.id)
+            with STORAGE_LOCK:
+                ids = SORTED_IDS.get(s_class)
+                if ids is not None:
+                    i = bisect_left(ids, self.id)
+                    if i < len(ids) and ids[i] == self.id:
+                        del ids[i]
+            self.__class__._persist(deletes=[self.id])
 
     @classmethod
-    def count(cls) -> int:
-        """ Count all objects
+    def _indexes(cls) -> dict:
+        """ Indexes of the class, by attribute
         """
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        if s_class not in INDEXES:
+            INDEXES[s_class] = {attribute: Index(attribute)
+                                for attribute in cls.indexed_attributes}
+        return INDEXES[s_class]
+
+    @classmethod
+    def _stored_value(cls, attribute: str, value):
+        """ Attribute value of a value read from a stored record, as
+        __init__ converts it
+        """
+        if attribute in ('created_at', 'updated_at') and value is not None:
+            return parse_timestamp(value)
+        return value
+
+    @classmethod
+    def _reindex(cls):
+        """ Rebuild the indexes of the class from DATA, and from the stored
+        values, converted, of the records not loaded yet
+        """
+        objs = DATA[cls.__name__].values()
+        raw = RAW.get(cls.__name__, {})
+        for index in cls._indexes().values():
+            index.clear()
+            for obj in objs:
+                index.add(obj)
+            for obj_id, obj_json in raw.items():
+                index.add_value(obj_id, cls._stored_value(
+                    index.attribute, obj_json.get(index.attribute)))
+
+    @classmethod
+    def _materialize(cls, obj_id: str) -> Optional[TypeVar('Base')]:
+        """ Return the object obj_id, building it from its raw record on
+        first use
+        """
+        s_class = cls.__name__
+        obj = DATA[s_class].get(obj_id)
+        if obj is not None or obj_id not in RAW.get(s_class, {}):
+            return obj
+        with STORAGE_LOCK:
+            obj_json = RAW[s_class].pop(obj_id, None)
+            if obj_json is not None:
+                DATA[s_class][obj_id] = cls(**obj_json)
+            return DATA[s_class].get(obj_id)
+
+    @classmethod
+    def _materialize_all(cls):
+        """ Build every object still held as a raw record
+        """
+        s_class = cls.__name__
+        if not RAW.get(s_class):
+            return
+        with STORAGE_LOCK:
+            for obj_id, obj_json in list(RAW[s_class].items()):
+                DATA[s_class][obj_id] = cls(**obj_json)
+            RAW[s_class] = {}
+
+    @classmethod
+    def count(cls, attributes: dict = {}) -> int:
+        """ Count all objects, or the objects matching attributes (see
+        search()). A single predicate answered by an index is counted
+        without building any object
+        """
+        s_class = cls.__name__
+        if STORAGE is not None:
+            return STORAGE.count(cls, attributes)
+        if len(attributes) == 0:
+            return len(DATA[s_class].keys()) + len(RAW.get(s_class, {}))
+        query = predicates(attributes)
+        ids = cls._plan(query)
+        if ids is not None and len(query) == 1:
+            return len(ids)
+        return sum(1 for _ in cls._select(query, ids))
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -114,25 +813,117 @@ class Base():
         """
         return cls.search()
 
+    @classmethod
+    def iterate(cls, after: str = None,
+                limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Yield objects ordered by ID, starting right after the ID `after`
+        and stopping after `limit` objects
+        IDs are read ITERATE_CHUNK at a time from the sorted IDs of the
+        class, and only the objects yielded are built from their raw
+        records
+        """
+        s_class = cls.__name__
+        if STORAGE is not None:
+            yield from STORAGE.iterate(cls, after, limit)
+            return
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = ITERATE_CHUNK if remaining is None \
+                else min(remaining, ITERATE_CHUNK)
+            with STORAGE_LOCK:
+                ids = SORTED_IDS.get(s_class)
+                if ids is None:
+                    ids = sorted(set(DATA[s_class]).union(
+                        RAW.get(s_class, {})))
+                    SORTED_IDS[s_class] = ids
+                start = 0 if after is None else bisect_right(ids, after)
+                chunk = ids[start:start + size]
+            if not chunk:
+                return
+            for obj_id in chunk:
+                obj = cls._materialize(obj_id)
+                if obj is not None:
+                    yield obj
+                    if remaining is not None:
+                        remaining -= 1
+            after = chunk[-1]
+
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        if STORAGE is not None:
+            return STORAGE.get(cls, id)
+        return cls._materialize(id)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+    def _plan(cls, query: list) -> Optional[List[str]]:
+        """ Access path of a query: the ids given by the index of one of
+        its predicates, equality lookups first, then ranges. None when no
+        index applies and every object has to be scanned
+        """
+        indexes = cls._indexes()
+        for lookups in (('exact', 'in'), RANGE_LOOKUPS):
+            for attribute, lookup, value in query:
+                if attribute not in indexes or lookup not in lookups:
+                    continue
+                index = indexes[attribute]
+                if lookup == 'exact':
+                    ids = index.lookup(value)
+                elif lookup == 'in':
+                    ids = index.lookup_in(value)
+                else:
+                    ids = index.lookup_range(lookup, value)
+                if ids is not None:
+                    return list(ids)
+        return None
+
+    @classmethod
+    def _select(cls, query: list,
+                ids: Optional[List[str]]) -> Iterator[TypeVar('Base')]:
+        """ Yield the objects matching every predicate of query, among the
+        objects ids, or among all objects when ids is None
+        """
+        if ids is None:
+            cls._materialize_all()
+            candidates = list(DATA[cls.__name__].values())
+        else:
+            candidates = (cls._materialize(obj_id) for obj_id in ids)
+        tests = [(attribute, matcher(lookup, value))
+                 for attribute, lookup, value in query]
+        for obj in candidates:
+            if obj is None:
+                continue
+            if all(test(getattr(obj, attribute))
+                   for attribute, test in tests):
+                yield obj
+
+    @classmethod
+    def search(cls, attributes: dict = {}, order_by: str = None,
+               limit: int = None, offset: int = 0) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+        Keys are attribute names, for equality, or `attribute__lookup`
+        with lookup one of exact, ne, gt, gte, lt, lte, startswith and in.
+        A predicate on an indexed attribute only checks the objects the
+        index gives for it, otherwise every object is scanned
+        order_by is an attribute name, prefixed with '-' for descending
+        order; limit and offset then select a page of the results
         """
-        s_class = cls.__name__
+        if STORAGE is not None:
+            return STORAGE.search(cls, attributes, order_by, limit, offset)
+        query = predicates(attributes)
+        matches = cls._select(query, cls._plan(query))
+        if order_by is None:
+            stop = None if limit is None else offset + limit
+            return list(islice(matches, offset, stop))
+        attribute = order_by.lstrip('-')
+        descending = order_by.startswith('-')
 
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
+        def _key(obj):
+            value = getattr(obj, attribute)
+            return (value is not None, value, obj.id)
 
-        return list(filter(_search, DATA[s_class].values()))
+        if limit is None:
+            return sorted(matches, key=_key, reverse=descending)[offset:]
+        select = heapq.nlargest if descending else heapq.nsmallest
+        return select(offset + limit, matches, key=_key)[offset:]
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+""" Lookups of the search() queries of the models
+A query is a dict of `attribute` or `attribute__lookup` keys to values,
+for instance {'email__startswith': 'bob', 'created_at__gte': date}
+"""
+from typing import Callable, Optional, Tuple
+import operator
+
+
+def _startswith(value, prefix) -> bool:
+    """ True if the string value starts with prefix
+    """
+    return isinstance(value, str) and value.startswith(prefix)
+
+
+def _in(value, values) -> bool:
+    """ True if value is one of values
+    """
+    return value in values
+
+
+LOOKUPS = {
+    'exact': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'startswith': _startswith,
+    'in': _in,
+}
+RANGE_LOOKUPS = ('gt', 'gte', 'lt', 'lte', 'startswith')
+
+
+def parse_lookup(key: str) -> Tuple[str, str]:
+    """ Split a query key into its attribute and lookup, 'exact' when the
+    key has no known lookup suffix
+    """
+    attribute, _, lookup = key.rpartition('__')
+    if attribute and lookup in LOOKUPS:
+        return attribute, lookup
+    return key, 'exact'
+
+
+def predicates(attributes: dict) -> list:
+    """ (attribute, lookup, value) of each entry of a query
+    """
+    result = []
+    for key, value in attributes.items():
+        attribute, lookup = parse_lookup(key)
+        result.append((attribute, lookup, value))
+    return result
+
+
+def matcher(lookup: str, value) -> Callable:
+    """ Test of an attribute value against a predicate, False when the
+    values can't be compared
+    """
+    test = LOOKUPS[lookup]
+
+    def _match(attribute_value) -> bool:
+        try:
+            return test(attribute_value, value)
+        except TypeError:
+            return False
+    return _match
+
+
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    """ Smallest string greater than every string starting with prefix,
+    None if there is none
+    """
+    while prefix and prefix[-1] == chr(0x10ffff):
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+""" SQLite storage backend of the models
+"""
+from datetime import datetime
+from os import getpid
+from threading import local
+from typing import Iterable, Iterator, List, Optional
+from models.query import predicates, prefix_upper_bound
+import json
+import sqlite3
+
+
+OPERATORS = {'exact': 'IS', 'ne': 'IS NOT', 'gt': '>', 'gte': '>=',
+             'lt': '<', 'lte': '<='}
+
+
+class SQLiteStorage():
+    """ Stores the objects of each model class in a table of one SQLite
+    database shared by every process
+    A row holds the id, the JSON record of the object and one indexed
+    column per attribute of indexed_attributes. Objects are built from
+    their row on every read, nothing is cached in memory
+    """
+
+    def __init__(self, db_path: str, timestamp_format: str,
+                 timeout: float = 5):
+        """ Initialize the backend of the database at db_path
+        """
+        self.db_path = db_path
+        self.timestamp_format = timestamp_format
+        self.timeout = timeout
+        self._local = local()
+        self._tables = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread, opened on first use and
+        reopened in a forked process
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != getpid():
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = getpid()
+        return conn
+
+    def _param(self, value):
+        """ Value as stored in a row
+        """
+        if type(value) is datetime:
+            return value.strftime(self.timestamp_format)
+        return value
+
+    @staticmethod
+    def _column(attribute: str) -> str:
+        """ Column of an indexed attribute
+        """
+        return '"a_{}"'.format(attribute)
+
+    def _table(self, cls: type) -> str:
+        """ Quoted table name of cls, created with its indexes on first use
+        Indexed attributes declared after the table was created get their
+        column, filled from the JSON records
+        """
+        table = self._tables.get(cls.__name__)
+        if table is not None:
+            return table
+        table = '"{}"'.format(cls.__name__)
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS {} "
+                     "(id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+                     .format(table))
+        columns = {row[1] for row in
+                   conn.execute("PRAGMA table_info({})".format(table))}
+        for attribute in cls.indexed_attributes:
+            column = self._column(attribute)
+            if column.strip('"') not in columns:
+                conn.execute("ALTER TABLE {} ADD COLUMN {}"
+                             .format(table, column))
+                conn.execute("UPDATE {} SET {} = json_extract(data, ?)"
+                             .format(table, column),
+                             ('$."{}"'.format(attribute),))
+            conn.execute("CREATE INDEX IF NOT EXISTS \"{}_{}\" ON {} ({})"
+                         .format(cls.__name__, attribute, table, column))
+        self._tables[cls.__name__] = table
+        return table
+
+    def _build(self, cls: type, rows: Iterable[tuple]) -> Iterator:
+        """ Objects of cls built from (data,) rows
+        """
+        for (data,) in rows:
+            yield cls(**json.loads(data))
+
+    def _expression(self, cls: type, attribute: str) -> tuple:
+        """ SQL expression and parameters of an attribute: its indexed
+        column if it has one, its value in the JSON record otherwise
+        """
+        if attribute in cls.indexed_attributes:
+            return self._column(attribute), []
+        return "json_extract(data, ?)", ['$."{}"'.format(attribute)]
+
+    def _where(self, cls: type, attributes: dict) -> tuple:
+        """ WHERE clause and parameters of a search() query
+        """
+        clauses, params = [], []
+        for attribute, lookup, value in predicates(attributes):
+            expression, expression_params = self._expression(cls, attribute)
+            if lookup == 'in':
+                values = [self._param(item) for item in value]
+                clause = "{} IN ({})".format(
+                    expression, ", ".join("?" * len(values)))
+                clause_params = expression_params + values
+                if None in values:
+                    clause = "({} OR {} IS NULL)".format(clause, expression)
+                    clause_params += expression_params
+            elif lookup == 'startswith':
+                clause = "{} >= ?".format(expression)
+                clause_params = expression_params + [value]
+                upper = prefix_upper_bound(value)
+                if upper is not None:
+                    clause += " AND {} < ?".format(expression)
+                    clause_params += expression_params + [upper]
+            else:
+                clause = "{} {} ?".format(expression, OPERATORS[lookup])
+                clause_params = expression_params + [self._param(value)]
+            clauses.append(clause)
+            params += clause_params
+        if not clauses:
+            return "", ()
+        return " WHERE " + " AND ".join(clauses), tuple(params)
+
+    def load(self, cls: type):
+        """ Prepare the table of cls
+        """
+        self._table(cls)
+
+    def get(self, cls: type, obj_id: str) -> Optional[object]:
+        """ Object of cls with id obj_id, None if there is none
+        """
+        cursor = self._connection().execute(
+            "SELECT data FROM {} WHERE id = ?".format(self._table(cls)),
+            (obj_id,))
+        return next(self._build(cls, cursor), None)
+
+    def search(self, cls: type, attributes: dict = {}, order_by: str = None,
+               limit: int = None, offset: int = 0) -> List[object]:
+        """ Objects of cls matching a search() query, sorted and paged by
+        the database
+        """
+        where, params = self._where(cls, attributes)
+        query = "SELECT data FROM {}{}".format(self._table(cls), where)
+        if order_by is not None:
+            direction = "DESC" if order_by.startswith('-') else "ASC"
+            expression, expression_params = self._expression(
+                cls, order_by.lstrip('-'))
+            query += " ORDER BY {0} {1}, id {1}".format(expression,
+                                                        direction)
+            params += tuple(expression_params)
+        if limit is not None or offset:
+            query += " LIMIT ? OFFSET ?"
+            params += (-1 if limit is None else limit, offset)
+        cursor = self._connection().execute(query, params)
+        return list(self._build(cls, cursor))
+
+    def iterate(self, cls: type, after: str = None,
+                limit: int = None) -> Iterator[object]:
+        """ Objects of cls ordered by id, starting right after the id
+        `after` and stopping after `limit` objects
+        """
+        query = "SELECT data FROM {} WHERE id > ? ORDER BY id LIMIT ?"
+        cursor = self._connection().execute(
+            query.format(self._table(cls)),
+            ('' if after is None else after, -1 if limit is None else limit))
+        return self._build(cls, cursor)
+
+    def count(self, cls: type, attributes: dict = {}) -> int:
+        """ Number of objects of cls matching a search() query
+        """
+        where, params = self._where(cls, attributes)
+        cursor = self._connection().execute(
+            "SELECT COUNT(*) FROM {}{}".format(self._table(cls), where),
+            params)
+        return cursor.fetchone()[0]
+
+    def write(self, cls: type, upserts: Iterable[object] = (),
+              deletes: Iterable[str] = ()):
+        """ Insert or replace upserts and delete the ids in deletes, in one
+        transaction
+        """
+        table = self._table(cls)
+        columns = ", ".join(["id", "data"] + [
+            self._column(attribute) for attribute in cls.indexed_attributes])
+        rows = [tuple([obj.id, json.dumps(obj.to_json(True))] + [
+            self._param(getattr(obj, attribute, None))
+            for attribute in cls.indexed_attributes]) for obj in upserts]
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if rows:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+                        table, columns, ", ".join("?" * len(rows[0]))),
+                    rows)
+            conn.executemany("DELETE FROM {} WHERE id = ?".format(table),
+                             [(obj_id,) for obj_id in deletes])
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 """ new authentication system, based on Session ID stored in database """
 from models.base import Base
+from sys import intern
 
 
 class UserSession(Base):
     """ Implements a UserSession class """
 
+    __slots__ = ('user_id', 'session_id')
+    indexed_attributes = ('session_id',)
+
     def __init__(self, *args: list, **kwargs: dict):
-        """ Class initialization method """
+        """ Class initialization method
+        user_id is interned: every session of a user shares one string
+        """
         super().__init__(*args, **kwargs)
-        self.user_id: str = kwargs.get('user_id')
+        user_id = kwargs.get('user_id')
+        if isinstance(user_id, str):
+            user_id = intern(user_id)
+        self.user_id: str = user_id
         self.session_id: str = kwargs.get('session_id')
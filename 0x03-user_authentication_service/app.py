@@ -5,11 +5,18 @@ Creates a simple flask app
 """
 from flask import Flask, jsonify, request, abort, url_for, redirect
 from auth import Auth
+from password_service import PasswordServiceBusy
 
 app = Flask(__name__)
 AUTH = Auth()
 
 
+@app.errorhandler(PasswordServiceBusy)
+def password_service_busy(error) -> str:
+    """ Too many logins in flight, ask the client to retry """
+    return jsonify({"message": "service busy"}), 503, {"Retry-After": "1"}
+
+
 @app.route('/', methods=['GET'], strict_slashes=False)
 def home():
     """ Defines the home route """
@@ -28,6 +35,8 @@ def users() -> str:
             "message": "user created"
         }
         return jsonify(response_data), 200
+    except PasswordServiceBusy:
+        raise
     except Exception as e:
         return jsonify({"message": "email already registered"}), 400
 
@@ -99,6 +108,8 @@ def update_password() -> str:
         return jsonify(
             {"email": email, "message": "Password updated"}
         ), 200
+    except PasswordServiceBusy:
+        raise
     except Exception:
         abort(403)
 
@@ -4,26 +4,29 @@ from db import DB
 from user import User
 from sqlalchemy.orm.exc import NoResultFound
 from uuid import uuid4
-import bcrypt
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from typing import Iterable, Iterator, List, Tuple
+from password_service import get_password_service, hash_with_rounds
 
 
 def _hash_password(password: str) -> bytes:
     """
     Method that takes in a password string arguments and returns bytes.
     The returned bytes is a salted hash of the input password, hashed
-    with bcrypt.hashpw
+    with bcrypt.hashpw on the password service worker pool
     """
-    # Generate a salt and hash the password
-    # converting password to array of bytes
-    bytes = password.encode('utf-8')
+    return get_password_service().hash(password)
 
-    # generating the salt
-    salt = bcrypt.gensalt()
 
-    # Hashing the password
-    hashed_password = bcrypt.hashpw(bytes, salt)
-
-    return hashed_password
+def _batches(items: Iterable, size: int) -> Iterator[List]:
+    """ Yields successive lists of at most size items """
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
 
 
 def _generate_uuid() -> str:
@@ -35,9 +38,11 @@ class Auth:
     """Auth class to interact with the authentication database.
     """
 
-    def __init__(self):
-        """ Initialize class object """
-        self._db = DB()
+    def __init__(self, reset: bool = True):
+        """ Initialize class object
+        reset=False keeps the users already in the database
+        """
+        self._db = DB(reset)
 
     def register_user(self, email: str, password: str) -> User:
         """
@@ -58,18 +63,59 @@ class Auth:
         user = self._db.add_user(email=email, hashed_password=hash_password)
         return user
 
+    def register_users(self, users: Iterable[Tuple[str, str]],
+                       batch_size: int = 1000, processes: int = None) -> int:
+        """
+        Registers many users at once
+        users is an iterable of (email, password) pairs, consumed lazily.
+        Emails already registered, or seen earlier in users, are skipped.
+        Each batch is hashed by a pool of processes and saved with a
+        single insert.
+        Returns the number of users created
+        """
+        rounds = get_password_service().rounds
+        seen = set()
+        created = 0
+        with ProcessPoolExecutor(processes) as pool:
+            for batch in _batches(users, batch_size):
+                existing = self._db.existing_emails(
+                    {email for email, _ in batch})
+                unique = {}
+                for email, password in batch:
+                    if not email or not password or email in seen or \
+                            email in existing:
+                        continue
+                    unique.setdefault(email, password)
+                seen.update(unique)
+                hashes = pool.map(hash_with_rounds, unique.values(),
+                                  repeat(rounds),
+                                  chunksize=max(1, len(unique) // 64))
+                created += self._db.add_users(zip(unique, hashes))
+        return created
+
     def valid_login(self, email: str, password: str) -> bool:
         """
         Credentials validation
         Search the user by email. If exists, check the password.
         If it matches return True. In any other case, return False
+        A matching password hashed at another bcrypt cost than the current
+        one is rehashed and stored, best effort: if that fails the login
+        still succeeds and the next one retries
         """
         try:
             user = self._db.find_user_by(email=email)
-            pass_bytes = password.encode('utf-8')
-            return bcrypt.checkpw(pass_bytes, user.hashed_password)
+            passwords = get_password_service()
+            if not passwords.verify(password, user.hashed_password):
+                return False
         except NoResultFound:
             return False
+        if passwords.needs_rehash(user.hashed_password):
+            try:
+                self._db.update_user(
+                    user.id, hashed_password=passwords.hash(password))
+            except Exception:
+                pass
+        return True
         # return False
 
     def create_session(self, email: str) -> str:
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Module benchmark_passwords
+Compares the password hashing schemes used across the projects and prints
+a login capacity table
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+import argparse
+import hashlib
+import os
+import time
+import bcrypt
+
+PASSWORD = 'b4l0u-t4rt1fl3tt3'
+PERCENTILES = (50, 90, 99)
+
+
+def sha256_hash(password: str) -> str:
+    """ User.password setter of the Basic/Session authentication models """
+    return hashlib.sha256(password.encode()).hexdigest().lower()
+
+
+def sha256_verify(password: str, hashed: str) -> bool:
+    """ User.is_valid_password of the Basic/Session authentication models """
+    return hashlib.sha256(password.encode()).hexdigest().lower() == hashed
+
+
+def bcrypt_hash(password: str, rounds: int) -> bytes:
+    """ encrypt_password.hash_password / auth._hash_password """
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+
+
+def bcrypt_verify(password: str, hashed: bytes) -> bool:
+    """ encrypt_password.is_valid / Auth.valid_login """
+    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+
+
+def timed(fn: Callable, *args) -> float:
+    """ Returns the duration of fn(*args) in seconds """
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def percentile(samples: List[float], rank: int) -> float:
+    """ Returns the rank-th percentile of sorted samples """
+    return samples[min(len(samples) - 1, int(len(samples) * rank / 100))]
+
+
+def run(fn: Callable, args: Tuple, operations: int, workers: int,
+        executor: str) -> Dict:
+    """
+    Runs fn(*args) operations times on workers threads or processes
+    Returns:
+      the operations per second and the latency percentiles in ms
+    """
+    pool_class = ThreadPoolExecutor if executor == 'thread' \
+        else ProcessPoolExecutor
+    chunksize = max(1, operations // (workers * 4))
+    with pool_class(max_workers=workers) as pool:
+        # warm the workers up before measuring
+        list(pool.map(timed, [fn] * workers, *[[a] * workers for a in args]))
+        start = time.perf_counter()
+        latencies = sorted(pool.map(
+            timed, [fn] * operations, *[[a] * operations for a in args],
+            chunksize=chunksize))
+        elapsed = time.perf_counter() - start
+    result = {'ops_per_second': operations / elapsed}
+    for rank in PERCENTILES:
+        result['p{}_ms'.format(rank)] = percentile(latencies, rank) * 1000
+    return result
+
+
+def cases(rounds: List[int]) -> List[Tuple[str, str, Callable, Tuple]]:
+    """ Returns the (scheme, operation, function, arguments) to measure """
+    result = [
+        ('sha256', 'hash', sha256_hash, (PASSWORD,)),
+        ('sha256', 'verify', sha256_verify, (PASSWORD,
+                                             sha256_hash(PASSWORD))),
+    ]
+    for cost in rounds:
+        scheme = 'bcrypt-{}'.format(cost)
+        result.append((scheme, 'hash', bcrypt_hash, (PASSWORD, cost)))
+        result.append((scheme, 'verify', bcrypt_verify,
+                       (PASSWORD, bcrypt_hash(PASSWORD, cost))))
+    return result
+
+
+def main() -> None:
+    """ Parses the command line, runs the benchmark and prints the table """
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-r', '--rounds', type=int, nargs='+',
+                        default=[10, 11, 12, 13],
+                        help="bcrypt costs to measure")
+    parser.add_argument('-w', '--workers', type=int, nargs='+',
+                        default=sorted({1, cores}),
+                        help="worker counts to measure")
+    parser.add_argument('-e', '--executor', nargs='+',
+                        choices=('thread', 'process'),
+                        default=['thread', 'process'])
+    parser.add_argument('-n', '--operations', type=int, default=32,
+                        help="bcrypt operations per case, x1000 for sha256")
+    args = parser.parse_args()
+
+    print("{:<10} {:<7} {:<8} {:>7} {:>12} {:>14} {:>9} {:>9} {:>9}".format(
+        'scheme', 'op', 'executor', 'workers', 'ops/s', 'logins/s/core',
+        'p50 ms', 'p90 ms', 'p99 ms'))
+    for scheme, operation, fn, fn_args in cases(args.rounds):
+        operations = args.operations
+        if scheme == 'sha256':
+            operations *= 1000
+        for executor in args.executor:
+            for workers in args.workers:
+                result = run(fn, fn_args, operations, workers, executor)
+                per_core = result['ops_per_second'] / min(workers, cores)
+                print("{:<10} {:<7} {:<8} {:>7} {:>12.1f} {:>14.1f} "
+                      "{:>9.3f} {:>9.3f} {:>9.3f}".format(
+                          scheme, operation, executor, workers,
+                          result['ops_per_second'], per_core,
+                          result['p50_ms'], result['p90_ms'],
+                          result['p99_ms']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Module bulk_import
+Registers users in bulk from a CSV or NDJSON file
+"""
+from typing import Iterator, TextIO, Tuple
+import argparse
+import csv
+import json
+from auth import Auth
+
+
+def read_csv(f: TextIO) -> Iterator[Tuple[str, str]]:
+    """ Yields (email, password) pairs from a CSV file with a header row """
+    for row in csv.DictReader(f):
+        yield row.get('email'), row.get('password')
+
+
+def read_ndjson(f: TextIO) -> Iterator[Tuple[str, str]]:
+    """ Yields (email, password) pairs from one JSON object per line """
+    for line in f:
+        if line.strip():
+            record = json.loads(line)
+            yield record.get('email'), record.get('password')
+
+
+def main() -> None:
+    """ Parses the command line and imports the file """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file', help="users with email and password fields")
+    parser.add_argument('--format', choices=('csv', 'ndjson'), default=None,
+                        help="file format, guessed from the extension")
+    parser.add_argument('-b', '--batch-size', type=int, default=1000)
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help="hashing processes, one per core by default")
+    args = parser.parse_args()
+
+    file_format = args.format
+    if file_format is None:
+        file_format = 'csv' if args.file.endswith('.csv') else 'ndjson'
+    reader = read_csv if file_format == 'csv' else read_ndjson
+
+    auth = Auth(reset=False)
+    with open(args.file, newline='') as f:
+        created = auth.register_users(reader(f), args.batch_size,
+                                      args.processes)
+    print("{} users created".format(created))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm.exc import NoResultFound
+from typing import Iterable, Set, Tuple
 
 from user import Base, User
 
@@ -15,11 +16,14 @@ class DB:
     """DB class
     """
 
-    def __init__(self) -> None:
+    def __init__(self, reset: bool = True) -> None:
         """Initialize a new DB instance
+        Args:
+            reset(bool): drop existing tables, False to keep the data
         """
         self._engine = create_engine("sqlite:///a.db", echo=False)
-        Base.metadata.drop_all(self._engine)
+        if reset:
+            Base.metadata.drop_all(self._engine)
         Base.metadata.create_all(self._engine)
         self.__session = None
 
@@ -46,6 +50,34 @@ class DB:
         self._session.commit()
         return new_user
 
+    def add_users(self, users: Iterable[Tuple[str, bytes]]) -> int:
+        """
+        The method to save many users with a single insert and commit.
+        Args:
+            users(iterable): (email, hashed_password) pairs
+        Returns:
+            the number of users saved
+        """
+        rows = [{'email': email, 'hashed_password': hashed_password}
+                for email, hashed_password in users]
+        if rows:
+            self._session.bulk_insert_mappings(User, rows)
+            self._session.commit()
+        return len(rows)
+
+    def existing_emails(self, emails: Iterable[str]) -> Set[str]:
+        """
+        Method returning which of the given emails are already registered
+        """
+        emails = list(emails)
+        found = set()
+        # stay below the SQLite bound parameters limit
+        for i in range(0, len(emails), 500):
+            query = self._session.query(User.email).filter(
+                User.email.in_(emails[i:i + 500]))
+            found.update(email for email, in query)
+        return found
+
     def find_user_by(self, **kwargs) -> User:
         """
         Method takes in arbitrary keyword arguments and returns the first row
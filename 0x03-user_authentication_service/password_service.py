@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Module password_service
+Runs bcrypt hashing and verification on a bounded pool of worker threads
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+import asyncio
+import os
+import threading
+import time
+import bcrypt
+
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+class PasswordServiceBusy(Exception):
+    """ Raised when too many hash operations are already pending """
+
+
+def calibrate_rounds(target_ms: float, min_rounds: int = MIN_ROUNDS,
+                     max_rounds: int = MAX_ROUNDS) -> int:
+    """
+    Benchmarks bcrypt on this machine and returns the highest cost whose
+    hash takes at most target_ms milliseconds, never below min_rounds
+    Each extra round doubles the work, so the search stops as soon as the
+    next cost is expected to overshoot the target
+    """
+    rounds = min_rounds
+    while rounds < max_rounds:
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms * 2 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+def hash_with_rounds(password: str, rounds: int) -> bytes:
+    """ Returns the salted bcrypt hash of password at the given cost """
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """ Returns the cost stored in a bcrypt hash ($2b$<cost>$...) """
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('utf-8')
+    return int(hashed_password.split(b'$')[2])
+
+
+class PasswordService:
+    """
+    Executor backed password hashing
+    bcrypt releases the GIL, so up to `workers` operations run in parallel
+    while at most `max_pending` may be queued or running; past that
+    callers get PasswordServiceBusy instead of waiting
+    Methods:
+      - hash() / hash_async()
+      - verify() / verify_async()
+      - calibrate()
+      - needs_rehash()
+      - shutdown()
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None,
+                 rounds: int = DEFAULT_ROUNDS):
+        """ Initialize the worker pool
+        Args:
+          workers(int): the number of threads, the number of cores by default
+          max_pending(int): the queue depth limit, 4 per worker by default
+          rounds(int): the bcrypt cost of new hashes
+        """
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='bcrypt')
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        """ Schedules fn on the pool if the queue depth limit allows it """
+        if not self._pending.acquire(blocking=False):
+            raise PasswordServiceBusy(
+                "{} password operations pending".format(self.max_pending))
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def _hash(self, password: str) -> bytes:
+        """ Returns the salted bcrypt hash of password """
+        return hash_with_rounds(password, self.rounds)
+
+    @staticmethod
+    def _verify(password: str, hashed_password: bytes) -> bool:
+        """ Returns True if password matches hashed_password """
+        return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+    def hash(self, password: str) -> bytes:
+        """ Hashes password on the pool and waits for the result """
+        return self._submit(self._hash, password).result()
+
+    def verify(self, password: str, hashed_password: bytes) -> bool:
+        """ Checks password on the pool and waits for the result """
+        return self._submit(self._verify, password, hashed_password).result()
+
+    async def hash_async(self, password: str) -> bytes:
+        """ Awaitable version of hash() """
+        return await asyncio.wrap_future(self._submit(self._hash, password))
+
+    async def verify_async(self, password: str,
+                           hashed_password: bytes) -> bool:
+        """ Awaitable version of verify() """
+        return await asyncio.wrap_future(
+            self._submit(self._verify, password, hashed_password))
+
+    def calibrate(self, target_ms: float) -> int:
+        """
+        Sets the cost of new hashes to the highest one meeting target_ms
+        on this machine and returns it
+        """
+        self.rounds = calibrate_rounds(target_ms)
+        return self.rounds
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """ Returns True if hashed_password was not made at the current cost
+        """
+        try:
+            return hash_rounds(hashed_password) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self, wait: bool = True) -> None:
+        """ Stops the worker threads """
+        self._executor.shutdown(wait=wait)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_password_service() -> PasswordService:
+    """
+    Returns the process wide password service, sized by the
+    PASSWORD_WORKERS and PASSWORD_MAX_PENDING environment variables
+    Its bcrypt cost is PASSWORD_ROUNDS, or calibrated at startup when
+    PASSWORD_TARGET_MS sets a target hashing latency
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = PasswordService(
+                int(os.getenv('PASSWORD_WORKERS', 0)) or None,
+                int(os.getenv('PASSWORD_MAX_PENDING', 0)) or None,
+                int(os.getenv('PASSWORD_ROUNDS', DEFAULT_ROUNDS)))
+            target_ms = os.getenv('PASSWORD_TARGET_MS')
+            if target_ms:
+                _service.calibrate(float(target_ms))
+        return _service